@@ -1,10 +1,33 @@
+import collections
+import functools
+import io
 import tkinter as tk
 
+# Colors with a named Mermaid class (lowercase hex -> class name).
+_PREDEFINED_COLORS = {
+    "#1e90ff": "blue",
+    "#ff4500": "red",
+    "#32cd32": "green",
+    "#ffff00": "yellow",
+    "#ffa500": "orange",
+}
+
+# Single-letter ids for the first 26 nodes; later nodes use N<counter>.
+_NODE_IDS = tuple(chr(65 + i) for i in range(26))
+
+# Mermaid line templates, bound once at import time.
+_RECT_FMT = "    {0}[{1}];\n".format
+_DIAMOND_FMT = "    {0}{{{1}}};\n".format
+_EDGE_FMT = "    {0} --> {1};\n".format
+_LABELED_EDGE_FMT = "    {0} -- {1} --> {2};\n".format
+_CLASSDEF_FMT = "    classDef {0} fill:{1},stroke:#000,stroke-width:2px;\n".format
+_CLASS_FMT = "    class {0} {1};\n".format
+
 # ------------------------------------------
 # Class Node: Represents a node (rectangle or diamond)
 # ------------------------------------------
 class Node:
-    def __init__(self, canvas, node_id, x, y, text="Node", shape="rectangle", fill="#FFFFFF"):
+    def __init__(self, canvas, node_id, x, y, text="Node", shape="rectangle", fill="#FFFFFF", on_change=None, seq=0):
         self.canvas = canvas
         self.id = node_id
         self.x = x
@@ -18,49 +41,65 @@ class Node:
         elif self.shape == "diamond":
             self.width = 100
             self.height = 60
+        self.cx = x + self.width/2   # Cached center, kept in sync by update_position.
+        self.cy = y + self.height/2
+        self.x2 = x + self.width     # Cached bottom-right corner for hit-testing.
+        self.y2 = y + self.height
         self.item = None
         self.text_item = None
+        self.tag = f"node{node_id}"  # Shared by the shape and its label.
+        self.on_change = on_change  # Called when text or color changes.
+        self.cells = set()          # Spatial index cells covered by the node.
+        self.seq = seq              # Creation order; earlier nodes win overlapping hit tests.
         self.draw()
 
     def draw(self):
         if self.shape == "rectangle":
             self.item = self.canvas.create_rectangle(
                 self.x, self.y, self.x + self.width, self.y + self.height,
-                fill=self.fill, outline="black", width=2
+                fill=self.fill, outline="black", width=2, tags=(self.tag,)
             )
             self.text_item = self.canvas.create_text(
                 self.x + self.width/2, self.y + self.height/2,
-                text=self.text, font=("Arial", 10)
+                text=self.text, font=("Arial", 10), tags=(self.tag,)
             )
         elif self.shape == "diamond":
             cx = self.x + self.width/2
             cy = self.y + self.height/2
             points = [cx, self.y, self.x + self.width, cy, cx, self.y + self.height, self.x, cy]
             self.item = self.canvas.create_polygon(
-                points, fill=self.fill, outline="black", width=2
+                points, fill=self.fill, outline="black", width=2, tags=(self.tag,)
             )
-            self.text_item = self.canvas.create_text(cx, cy, text=self.text, font=("Arial", 10))
+            self.text_item = self.canvas.create_text(cx, cy, text=self.text, font=("Arial", 10),
+                                                     tags=(self.tag,))
 
     def update_position(self, new_x, new_y):
+        dx = new_x - self.x
+        dy = new_y - self.y
         self.x = new_x
         self.y = new_y
-        if self.shape == "rectangle":
-            self.canvas.coords(self.item, self.x, self.y, self.x + self.width, self.y + self.height)
-            self.canvas.coords(self.text_item, self.x + self.width/2, self.y + self.height/2)
-        elif self.shape == "diamond":
-            cx = self.x + self.width/2
-            cy = self.y + self.height/2
-            points = [cx, self.y, self.x + self.width, cy, cx, self.y + self.height, self.x, cy]
-            self.canvas.coords(self.item, *points)
-            self.canvas.coords(self.text_item, cx, cy)
+        self.cx = new_x + self.width/2
+        self.cy = new_y + self.height/2
+        self.x2 = new_x + self.width
+        self.y2 = new_y + self.height
+        # Shape and label share the node tag, so one call moves both.
+        self.canvas.move(self.tag, dx, dy)
 
     def update_text(self, new_text):
+        if new_text == self.text:
+            return
         self.text = new_text
         self.canvas.itemconfig(self.text_item, text=new_text)
+        if self.on_change:
+            self.on_change()
 
     def update_color(self, new_color):
+        if new_color == self.fill:
+            return
         self.fill = new_color
         self.canvas.itemconfig(self.item, fill=new_color)
+        if self.on_change:
+            self.on_change()
 
     def highlight(self, flag=True):
         if flag:
@@ -69,10 +108,10 @@ class Node:
             self.canvas.itemconfig(self.item, outline="black", width=2)
 
     def contains_point(self, x, y):
-        return self.x <= x <= self.x + self.width and self.y <= y <= self.y + self.height
+        return self.x <= x <= self.x2 and self.y <= y <= self.y2
 
     def get_center(self):
-        return (self.x + self.width/2, self.y + self.height/2)
+        return (self.cx, self.cy)
 
 
 # ------------------------------------------
@@ -98,8 +137,8 @@ class Edge:
             self.label_item = self.canvas.create_text(mx, my, text=self.label, fill="blue")
 
     def update_position(self):
-        sx, sy = self.source.get_center()
-        tx, ty = self.target.get_center()
+        source, target = self.source, self.target
+        sx, sy, tx, ty = source.cx, source.cy, target.cx, target.cy
         self.canvas.coords(self.line_item, sx, sy, tx, ty)
         if self.label_item:
             mx = (sx + tx) / 2
@@ -145,15 +184,25 @@ class DiagramEditor:
         self.current_edit_node = None  # Currently edited node.
         self.text_editor = None          # Entry widget embedded in the canvas.
         self.editor_window_id = None     # ID of the widget in the canvas.
-        self.palette_panel = None        # Color palette panel in the toolbar.
+        self.palette_panel = self._build_palette()  # Color palette panel in the toolbar.
+        self._text_update_pending = None  # after() id of the debounced text update.
+        self._status_clear_id = None      # after() id that clears the status label.
 
-        # Context menu to create nodes.
-        self.context_menu = tk.Menu(self.root, tearoff=0)
-        self.context_menu.add_command(label="Rectangle", command=lambda: self.create_node_at("rectangle"))
-        self.context_menu.add_command(label="Diamond", command=lambda: self.create_node_at("diamond"))
+        # Context menu to create nodes and copy status label, built on first use.
+        self.context_menu = None
+        self.status_label = None
+
+        # "Show Code" window, hidden on close and reused.
+        self._code_window = None
+        self._code_text = None
+        self._code_window_str = None  # Code currently shown in the window.
 
         self.nodes = {}    # Dictionary of nodes (id -> Node).
+        self._nodes_list = None  # Nodes in creation order, materialized for Mermaid emit.
         self.edges = []    # List of connections (Edge).
+        self.cell_size = 64
+        self.spatial = collections.defaultdict(set)  # Grid cell -> node ids.
+        self.node_edges = collections.defaultdict(list)  # Node id -> incident edges.
         self.node_counter = 0
         self.arrow_source = None  # Source node for connection.
 
@@ -161,6 +210,11 @@ class DiagramEditor:
         self.drag_offset_x = 0
         self.drag_offset_y = 0
         self.drag_threshold = 5
+        self._pending_drag = None  # Latest pointer position awaiting redraw.
+
+        # Cached Mermaid code, rebuilt only when the diagram changes.
+        self._mermaid_cache = None
+        self._dirty = True
 
         # Bind events to the canvas.
         self.canvas.bind("<Button-1>", self.on_left_click)
@@ -171,13 +225,20 @@ class DiagramEditor:
 
     def get_new_node_id(self):
         if self.node_counter < 26:
-            node_id = chr(65 + self.node_counter)
+            node_id = _NODE_IDS[self.node_counter]
         else:
             node_id = "N" + str(self.node_counter)
         self.node_counter += 1
         return node_id
 
+    def _build_context_menu(self):
+        self.context_menu = tk.Menu(self.root, tearoff=0)
+        self.context_menu.add_command(label="Rectangle", command=lambda: self.create_node_at("rectangle"))
+        self.context_menu.add_command(label="Diamond", command=lambda: self.create_node_at("diamond"))
+
     def on_right_click(self, event):
+        if self.context_menu is None:
+            self._build_context_menu()
         self.context_menu.post(event.x_root, event.y_root)
         self.context_menu_x = event.x
         self.context_menu_y = event.y
@@ -186,8 +247,13 @@ class DiagramEditor:
         x = self.context_menu_x
         y = self.context_menu_y
         node_id = self.get_new_node_id()
-        new_node = Node(self.canvas, node_id, x, y, text="Node", shape=shape, fill="#FFFFFF")
+        new_node = Node(self.canvas, node_id, x, y, text="Node", shape=shape, fill="#FFFFFF",
+                        on_change=self.invalidate_mermaid, seq=len(self.nodes))
         self.nodes[node_id] = new_node
+        if self._nodes_list is not None:
+            self._nodes_list.append(new_node)
+        self.index_node(new_node)
+        self.invalidate_mermaid()
         # Activate in-place editing immediately.
         self.start_editing_node(new_node)
 
@@ -206,7 +272,7 @@ class DiagramEditor:
         cx, cy = node.get_center()
         self.editor_window_id = self.canvas.create_window(cx, cy, window=self.text_editor)
         self.text_editor.focus_set()
-        self.text_editor.bind("<KeyRelease>", lambda event: node.update_text(self.text_editor.get()))
+        self.text_editor.bind("<KeyRelease>", self._on_editor_keyrelease)
         self.text_editor.bind("<Return>", self.finish_editing)
         self.text_editor.bind("<FocusOut>", self.finish_editing)
         self.show_palette_panel()
@@ -214,7 +280,22 @@ class DiagramEditor:
             self.arrow_source.highlight(False)
             self.arrow_source = None
 
+    def _on_editor_keyrelease(self, event):
+        # Debounce keystrokes so fast typing results in a single redraw.
+        if self._text_update_pending is not None:
+            self.root.after_cancel(self._text_update_pending)
+        self._text_update_pending = self.root.after(30, self._apply_text_change)
+
+    def _apply_text_change(self):
+        self._text_update_pending = None
+        if self.current_edit_node and self.text_editor:
+            self.current_edit_node.update_text(self.text_editor.get())
+
     def finish_editing(self, event=None):
+        if self._text_update_pending is not None:
+            # Applied directly below, so the debounced update is redundant.
+            self.root.after_cancel(self._text_update_pending)
+            self._text_update_pending = None
         if self.current_edit_node and self.text_editor:
             new_text = self.text_editor.get()
             self.current_edit_node.update_text(new_text)
@@ -223,18 +304,22 @@ class DiagramEditor:
         self.current_edit_node = None
 
     def remove_text_editor(self):
+        if self._text_update_pending is not None:
+            # Apply any debounced keystrokes before the editor goes away.
+            self.root.after_cancel(self._text_update_pending)
+            self._text_update_pending = None
+            if self.current_edit_node and self.text_editor:
+                self.current_edit_node.update_text(self.text_editor.get())
         if self.text_editor:
             self.canvas.delete(self.editor_window_id)
             self.text_editor.destroy()
             self.text_editor = None
             self.editor_window_id = None
 
-    def show_palette_panel(self):
-        self.instructions_label.pack_forget()
-        if self.palette_panel:
-            self.palette_panel.destroy()
-        self.palette_panel = tk.Frame(self.toolbar)
-        tk.Label(self.palette_panel, text="Choose color:", font=("Arial", 10, "bold")).pack(pady=5)
+    def _build_palette(self):
+        # Built once; shown and hidden with pack/pack_forget.
+        panel = tk.Frame(self.toolbar)
+        tk.Label(panel, text="Choose color:", font=("Arial", 10, "bold")).pack(pady=5)
         colors = [
             ("Red", "#FF0000"),
             ("Green", "#00FF00"),
@@ -244,16 +329,18 @@ class DiagramEditor:
             ("Black", "#000000"),
             ("White", "#FFFFFF")
         ]
-        for name, hex_color in colors:
-            btn = tk.Button(self.palette_panel, bg=hex_color, width=4,
-                            command=lambda c=hex_color: self.change_color(c))
+        for _, hex_color in colors:
+            btn = tk.Button(panel, bg=hex_color, width=4,
+                            command=functools.partial(self.change_color, hex_color))
             btn.pack(side=tk.LEFT, padx=2, pady=2)
+        return panel
+
+    def show_palette_panel(self):
+        self.instructions_label.pack_forget()
         self.palette_panel.pack(pady=10)
 
     def hide_palette_panel(self):
-        if self.palette_panel:
-            self.palette_panel.destroy()
-            self.palette_panel = None
+        self.palette_panel.pack_forget()
         self.instructions_label.pack(pady=10)
 
     def change_color(self, new_color):
@@ -266,6 +353,9 @@ class DiagramEditor:
             if node and node != self.arrow_source:
                 new_edge = Edge(self.canvas, self.arrow_source, node)
                 self.edges.append(new_edge)
+                self.node_edges[self.arrow_source.id].append(new_edge)
+                self.node_edges[node.id].append(new_edge)
+                self.invalidate_mermaid()
                 self.arrow_source.highlight(False)
                 self.arrow_source = None
             return
@@ -286,97 +376,149 @@ class DiagramEditor:
             node.highlight(True)
 
     def on_drag(self, event):
+        if not self.dragging_node:
+            return
+        # Coalesce motion events: only the latest position is applied on idle.
+        if self._pending_drag is None:
+            self.canvas.after_idle(self._flush_drag)
+        self._pending_drag = (event.x, event.y)
+
+    def _flush_drag(self, force=False):
+        if self._pending_drag is None:
+            return
+        x, y = self._pending_drag
+        self._pending_drag = None
         if self.dragging_node:
-            new_x = event.x - self.drag_offset_x
-            new_y = event.y - self.drag_offset_y
+            new_x = x - self.drag_offset_x
+            new_y = y - self.drag_offset_y
+            moved = abs(new_x - self.dragging_node.x) + abs(new_y - self.dragging_node.y)
+            # Ignore jitter below the threshold; the release still lands exactly.
+            if moved == 0 or (moved < self.drag_threshold and not force):
+                return
             self.dragging_node.update_position(new_x, new_y)
+            self.index_node(self.dragging_node)
             if self.current_edit_node == self.dragging_node and self.text_editor:
                 cx, cy = self.dragging_node.get_center()
                 self.canvas.coords(self.editor_window_id, cx, cy)
-            for edge in self.edges:
-                if edge.source == self.dragging_node or edge.target == self.dragging_node:
-                    edge.update_position()
+            for edge in self.node_edges[self.dragging_node.id]:
+                edge.update_position()
 
     def on_release(self, event):
+        if self.dragging_node:
+            self._pending_drag = (event.x, event.y)
+            self._flush_drag(force=True)
         self.dragging_node = None
 
+    def _cells_for(self, node):
+        size = self.cell_size
+        for cx in range(int(node.x // size), int((node.x + node.width) // size) + 1):
+            for cy in range(int(node.y // size), int((node.y + node.height) // size) + 1):
+                yield (cx, cy)
+
+    def index_node(self, node):
+        new_cells = set(self._cells_for(node))
+        if new_cells == node.cells:
+            return
+        for cell in node.cells - new_cells:
+            self.spatial[cell].discard(node.id)
+            if not self.spatial[cell]:
+                del self.spatial[cell]
+        for cell in new_cells - node.cells:
+            self.spatial[cell].add(node.id)
+        node.cells = new_cells
+
     def get_node_at(self, x, y):
-        for node in self.nodes.values():
-            if node.contains_point(x, y):
-                return node
-        return None
+        cell = (int(x // self.cell_size), int(y // self.cell_size))
+        found = None
+        for node_id in self.spatial.get(cell, ()):
+            node = self.nodes[node_id]
+            if node.contains_point(x, y) and (found is None or node.seq < found.seq):
+                found = node
+        return found
 
     def stop_editing(self):
         self.remove_text_editor()
         self.hide_palette_panel()
         self.current_edit_node = None
 
+    def invalidate_mermaid(self):
+        self._dirty = True
+
     def get_mermaid_code(self):
-        lines = []
-        lines.append("```mermaid")
-        lines.append("graph TD;")
-        for node in self.nodes.values():
-            if node.shape == "rectangle":
-                lines.append(f"    {node.id}[{node.text}];")
-            elif node.shape == "diamond":
-                lines.append(f"    {node.id}{{{node.text}}};")
+        if not self._dirty:
+            return self._mermaid_cache
+        buf = io.StringIO()
+        write = buf.write
+        write("```mermaid\ngraph TD;\n")
+        color_classes, groups = {}, {}
+        if self._nodes_list is None:
+            self._nodes_list = list(self.nodes.values())
+        # Single pass over the nodes: emit each node and assign its color class.
+        for node in self._nodes_list:
+            color = node.fill.lower()
+            class_name = color_classes.get(color)
+            if class_name is None:
+                class_name = _PREDEFINED_COLORS.get(color)
+                if class_name is None:
+                    class_name = "color" + str(len(color_classes) + 1)
+                color_classes[color] = class_name
+            groups.setdefault(class_name, []).append(node.id)
+            if node.shape == "diamond":
+                write(_DIAMOND_FMT(node.id, node.text))
             else:
-                lines.append(f"    {node.id}[{node.text}];")
+                write(_RECT_FMT(node.id, node.text))
         for edge in self.edges:
             if edge.label:
-                lines.append(f"    {edge.source.id} -- {edge.label} --> {edge.target.id};")
+                write(_LABELED_EDGE_FMT(edge.source.id, edge.label, edge.target.id))
             else:
-                lines.append(f"    {edge.source.id} --> {edge.target.id};")
-        predefined = {
-            "#1e90ff": ("blue", "#1E90FF"),
-            "#ff4500": ("red", "#FF4500"),
-            "#32cd32": ("green", "#32CD32"),
-            "#ffff00": ("yellow", "#FFFF00"),
-            "#ffa500": ("orange", "#FFA500")
-        }
-        color_classes = {}
-        for node in self.nodes.values():
-            color = node.fill.lower()
-            if color in predefined:
-                class_name = predefined[color][0]
-            else:
-                if color not in color_classes:
-                    class_name = "color" + str(len(color_classes) + 1)
-                else:
-                    class_name = color_classes[color]
-            color_classes[color] = class_name
+                write(_EDGE_FMT(edge.source.id, edge.target.id))
         for color, class_name in color_classes.items():
-            lines.append(f"    classDef {class_name} fill:{color},stroke:#000,stroke-width:2px;")
-        groups = {}
-        for node in self.nodes.values():
-            color = node.fill.lower()
-            class_name = color_classes[color]
-            groups.setdefault(class_name, []).append(node.id)
+            write(_CLASSDEF_FMT(class_name, color))
         for class_name, node_ids in groups.items():
-            lines.append(f"    class {','.join(node_ids)} {class_name};")
-        lines.append("```")
-        return "\n".join(lines)
+            write(_CLASS_FMT(",".join(node_ids), class_name))
+        write("```")
+        self._mermaid_cache = buf.getvalue()
+        self._dirty = False
+        return self._mermaid_cache
 
     def generate_mermaid(self):
         code_str = self.get_mermaid_code()
-        top = tk.Toplevel(self.root)
-        top.title("Mermaid Code")
-        text_widget = tk.Text(top, wrap="word")
-        text_widget.insert("1.0", code_str)
-        text_widget.config(state="disabled")
-        text_widget.pack(fill="both", expand=True)
-        top.lift()
-        top.focus_force()
+        if self._code_window and self._code_window.winfo_exists():
+            # Reuse the hidden window; only rewrite the text if the code changed.
+            if code_str != self._code_window_str:
+                self._code_text.config(state="normal")
+                self._code_text.delete("1.0", tk.END)
+                self._code_text.insert("1.0", code_str)
+                self._code_text.config(state="disabled")
+            self._code_window.deiconify()
+        else:
+            self._code_window = tk.Toplevel(self.root)
+            self._code_window.title("Mermaid Code")
+            self._code_window.protocol("WM_DELETE_WINDOW", self._code_window.withdraw)
+            self._code_text = tk.Text(self._code_window, wrap="word")
+            self._code_text.insert("1.0", code_str)
+            self._code_text.config(state="disabled")
+            self._code_text.pack(fill="both", expand=True)
+        self._code_window_str = code_str
+        self._code_window.update_idletasks()
+        self._code_window.lift()
 
     def copy_mermaid_to_clipboard(self):
         code_str = self.get_mermaid_code()
         self.root.clipboard_clear()
         self.root.clipboard_append(code_str)
-        if not hasattr(self, "status_label"):
+        if self.status_label is None:
             self.status_label = tk.Label(self.toolbar, text="", fg="green", font=("Arial", 10))
             self.status_label.pack(pady=5)
         self.status_label.config(text="Code copied to clipboard")
-        self.root.after(2000, lambda: self.status_label.config(text=""))
+        # Repeated copies restart the timer instead of stacking clear callbacks.
+        if self._status_clear_id is not None:
+            self.status_label.after_cancel(self._status_clear_id)
+        self._status_clear_id = self.status_label.after(2000, self._clear_status)
+
+    def _clear_status(self):
+        self._status_clear_id = None
+        self.status_label.config(text="")
 
 
 if __name__ == "__main__":